@@ -18,12 +18,23 @@ Melhorias implementadas:
 import argparse
 import json
 import logging
+import queue
+import random
 import serial
+import socket
 import struct
 import sys
+import threading
 import time
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Tuple, Union, Any
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+try:
+    import orjson  # Opcional: serialização JSON mais rápida
+except ImportError:
+    orjson = None
 
 # Configurações para MQTT Discovery (constantes globais)
 HA_DISCOVERY_PREFIX = "homeassistant"
@@ -39,6 +50,34 @@ DEVICE_SW_VERSION = "v7"  # Versão do script/firmware do UPS
 BAUD_RATE = 2400  # Padrão para SMS Gamer, mas configurável
 TIMEOUT = 3       # Timeout padrão em segundos
 
+# Buffers do driver serial no Windows (set_buffer_size; ignorado em outros SOs)
+SERIAL_RX_BUFFER_SIZE = 16384
+SERIAL_TX_BUFFER_SIZE = 1024
+
+# Tempo máximo de espera pela conexão MQTT antes de iniciar o monitoramento (s)
+MQTT_READY_TIMEOUT = 10
+
+# Idade máxima (s) de um comando MQTT na fila; mais antigo é descartado sem ser enviado
+COMMAND_MAX_AGE = 30
+
+# Topic Alias (MQTT 5) do tópico de status, usado se o broker permitir
+STATUS_TOPIC_ALIAS = 1
+
+# Republica o status mesmo sem mudanças a cada N leituras (heartbeat)
+STATUS_HEARTBEAT_POLLS = 6
+
+# Tamanhos de resposta do UPS (todas terminam em 0x0D)
+Q_RESPONSE_SIZE = 17    # Quadro binário de status do comando 'Q'
+Q_RESPONSE_HEADER = 0x3D  # Primeiro byte ('=') do quadro 'Q'
+RESPONSE_MAX_SIZE = 64  # Limite de leitura para uma resposta
+
+# Tamanho conhecido da resposta por comando; para os demais o tamanho é
+# desconhecido e a resposta é lida até uma pausa na linha (RESPONSE_QUIET_GAP)
+RESPONSE_MIN_SIZES = {'Q': Q_RESPONSE_SIZE}
+
+# Pausa (s) sem novos trechos que encerra uma resposta de tamanho desconhecido
+RESPONSE_QUIET_GAP = 0.2
+
 # Comandos predefinidos com seus parâmetros (cmd_byte, p1, p2, p3, p4)
 SMS_GAMER_COMMANDS_PARAMS = {
     # Comandos básicos de consulta
@@ -73,6 +112,122 @@ SMS_GAMER_COMMANDS_PARAMS = {
     # 'W': (0x57, 0xFF, 0xFF, 0xFF, 0xFF),    # Comando W (função desconhecida)
 }
 
+
+def _pack(cmd_byte: int, p1: int, p2: int, p3: int, p4: int) -> bytes:
+    """
+    Monta o pacote de 7 bytes (comando, parâmetros, checksum e 0x0D).
+
+    Args:
+        cmd_byte (int): Byte do comando.
+        p1, p2, p3, p4 (int): Parâmetros do comando.
+
+    Returns:
+        bytes: Pacote completo pronto para envio.
+    """
+    checksum = -(cmd_byte + p1 + p2 + p3 + p4) & 0xFF
+    return bytes((cmd_byte, p1, p2, p3, p4, checksum, 0x0D))
+
+
+# Pacotes pré-montados na importação (os parâmetros dos comandos são estáticos)
+SMS_GAMER_COMMAND_PACKETS: Dict[str, bytes] = {
+    key: _pack(*params) for key, params in SMS_GAMER_COMMANDS_PARAMS.items()
+}
+
+# Estrutura do pacote de comando montado por build_full_command (sem o 0x0D final)
+_PKT_STRUCT = struct.Struct("6B")
+
+# Layout da resposta 'Q' a partir do byte 1: vin (I), vout, carga, frequência,
+# bateria, temperatura (H, em décimos) e byte de flags (B)
+_Q_STRUCT = struct.Struct(">IHHHHHB")
+
+# Nomes das flags do byte extra, indexados pela posição do bit (bit 0 = BeepLigado)
+_FLAG_NAMES = (
+    "BeepLigado",
+    "ShutdownAtivo",
+    "TesteAtivo",
+    "UpsOk",
+    "Boost",
+    "ByPass",
+    "BateriaBaixa",
+    "BateriaEmUso",
+)
+_TS_FMT = '%Y-%m-%d %H:%M:%S'
+
+# Campos do status publicados no MQTT; raw_response_hex e extra_flags_binary
+# são só para depuração (--test-cmd) e não são usados pelas entidades do HA
+_MQTT_STATUS_FIELDS = (
+    'vin', 'vout', 'load_percent', 'frequency', 'battery_percent', 'temperature',
+    'extra_flags_raw', 'active_flags', 'active_flags_str', 'timestamp',
+)
+
+# Decodificação do byte de flags pré-calculada na importação para os 256 valores
+# possíveis: (flags ativas do bit mais significativo para o menos, texto, binário)
+_FLAGS_BY_BYTE = []
+for _extra in range(256):
+    _names = tuple(_FLAG_NAMES[bit] for bit in range(7, -1, -1) if _extra >> bit & 1)
+    _FLAGS_BY_BYTE.append((
+        _names,
+        ', '.join(_names) if _names else 'nenhuma flag ativa',
+        format(_extra, '08b'),
+    ))
+_FLAGS_BY_BYTE = tuple(_FLAGS_BY_BYTE)
+del _extra, _names
+
+
+def parse_q_frame(frame: Union[bytes, memoryview]) -> Dict[str, Any]:
+    """
+    Decodifica um quadro 'Q' já validado (sem o terminador 0x0D).
+
+    Função pura, sem estado nem logging, mantida fora da classe para ficar
+    isolada do caminho de I/O.
+
+    Args:
+        frame (bytes | memoryview): Quadro de status com pelo menos 16 bytes.
+
+    Returns:
+        Dict[str, Any]: Medições, flags e metadados da leitura.
+    """
+    vin_raw, vout_raw, power_raw, freq_raw, batt_raw, temp_raw, extra = _Q_STRUCT.unpack_from(frame, 1)
+    flags_on, flags_str, extra_flags_bin = _FLAGS_BY_BYTE[extra]
+
+    # Os valores brutos são inteiros em décimos: a divisão por 10 já resulta no
+    # float mais próximo de uma casa decimal (mesmo valor que round(x, 1))
+    data = {
+        'vin': vin_raw / 10,
+        'vout': vout_raw / 10,
+        'load_percent': power_raw / 10,
+        'frequency': freq_raw / 10,
+        'battery_percent': batt_raw / 10,
+        'temperature': temp_raw / 10,
+        'extra_flags_raw': extra,
+        'extra_flags_binary': extra_flags_bin,
+        'active_flags': list(flags_on),
+        'active_flags_str': flags_str,
+        'raw_response_hex': frame.hex(),
+        'timestamp': time.strftime(_TS_FMT),
+    }
+    return data
+
+
+if orjson is not None:
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(obj: Any) -> bytes:
+        """
+        Serializa um objeto em JSON UTF-8 compacto, como o orjson (fallback sem orjson).
+
+        Args:
+            obj (Any): Objeto a serializar.
+
+        Returns:
+            bytes: JSON codificado em UTF-8.
+        """
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+    _json_loads = json.loads
+
+
 # Configurar logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -84,6 +239,37 @@ logger.addHandler(handler)
 logger.propagate = False
 
 
+class _Backoff:
+    """
+    Espera exponencial com jitter entre tentativas de reconexão, evitando
+    tentativas agressivas durante falhas prolongadas.
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 120.0,
+                 multiplier: float = 2.0, jitter: float = 0.25):
+        """
+        Args:
+            initial (float): Espera da primeira tentativa em segundos.
+            maximum (float): Espera máxima em segundos.
+            multiplier (float): Fator de crescimento a cada tentativa.
+            jitter (float): Variação aleatória relativa (0.25 = ±25%).
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self._delay = initial
+
+    def next(self) -> float:
+        """
+        Returns:
+            float: Espera (em segundos) antes da próxima tentativa.
+        """
+        delay = self._delay
+        self._delay = min(self.maximum, self._delay * self.multiplier)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+
 class SMSGamerProtocol:
     """
     Gerencia a comunicação com o nobreak SMS Gamer via porta serial
@@ -113,6 +299,19 @@ class SMSGamerProtocol:
         self.connected = False
         self.baud_rate = baud_rate
         self.timeout = timeout
+
+        # Respostas recebidas pela thread leitora da porta serial
+        self._rx_q: "queue.Queue[bytes]" = queue.Queue()
+        self._rx_thread: Optional[threading.Thread] = None
+
+        # Buffer de build_full_command, por instância; o terminador 0x0D é fixo
+        self._cmd_buf = bytearray(_PKT_STRUCT.size + 1)
+        self._cmd_buf[-1] = 0x0D
+        # Pedido da thread de envio para a leitora descartar bytes parciais pendentes
+        self._rx_flush = threading.Event()
+        # Torna atômicos o pedido de descarte + esvaziamento da fila (_drain_rx_queue)
+        # e a verificação do pedido + entrega de um trecho à fila (_rx_loop)
+        self._rx_lock = threading.Lock()
         
         # Mapeamento de comandos simples para compatibilidade
         self.simple_commands_map = {
@@ -135,6 +334,38 @@ class SMSGamerProtocol:
         self.DEVICE_MANUFACTURER = DEVICE_MANUFACTURER
         self.DEVICE_MODEL = DEVICE_MODEL
         self.DEVICE_SW_VERSION = DEVICE_SW_VERSION
+        self._status_topic = f"{self.MQTT_TOPIC_BASE}/status"
+        self._command_topic = f"{self.MQTT_TOPIC_BASE}/command"
+        # Birth/LWT do Home Assistant ("online" quando o HA inicia)
+        self._ha_status_topic = f"{self.HA_DISCOVERY_PREFIX}/status"
+
+        # Comandos recebidos via MQTT, executados pelo loop de monitoramento para
+        # que só uma thread escreva na porta serial
+        # (chave do comando, instante monotônico de chegada)
+        self._cmd_queue: "queue.Queue[Tuple[str, float]]" = queue.Queue()
+        # Sinaliza ao loop de monitoramento que deve ler o status imediatamente
+        self._wakeup = threading.Event()
+        # Setado por _on_mqtt_connect quando o broker aceita a conexão
+        self._mqtt_ready = threading.Event()
+
+        # Último status publicado (status retido; só republica quando muda)
+        self._last_status: Dict[str, Any] = {}
+        self._unchanged_polls = 0
+
+        # Topic Alias do status: após o primeiro PUBLISH o tópico vai vazio,
+        # só com o alias de 2 bytes (renegociado a cada conexão)
+        self._status_props = Properties(PacketTypes.PUBLISH)
+        self._status_props.TopicAlias = STATUS_TOPIC_ALIAS
+        self._status_alias_enabled = False
+        self._status_alias_sent = False
+        # Protege o estado do alias entre a thread principal e os callbacks do paho
+        self._status_alias_lock = threading.Lock()
+
+        # Payloads de discovery montados uma única vez
+        self._discovery_frames = self._prepare_discovery()
+        # Discovery é retido no broker: só republica se o último envio não foi
+        # confirmado por completo ou se o HA reiniciar
+        self._discovery_infos: List[mqtt.MQTTMessageInfo] = []
 
     def connect(self) -> bool:
         """
@@ -149,20 +380,55 @@ class SMSGamerProtocol:
                 baudrate=self.baud_rate,
                 timeout=self.timeout
             )
+            # Só existe no Windows: o buffer padrão do driver pode transbordar
+            # com respostas de vários quadros ('I', 'F')
+            if hasattr(self.serial, 'set_buffer_size'):
+                self.serial.set_buffer_size(rx_size=SERIAL_RX_BUFFER_SIZE, tx_size=SERIAL_TX_BUFFER_SIZE)
             self.connected = True
+            self._rx_thread = threading.Thread(target=self._rx_loop, args=(self.serial,),
+                                               name="sms_gamer_rx", daemon=True)
+            self._rx_thread.start()
             logger.info(f"✅ Conectado ao SMS Gamer em {self.port} (Baud: {self.baud_rate}, Timeout: {self.timeout}s)")
             return True
         except Exception as e:
             logger.error(f"❌ Erro ao conectar: {e}")
             return False
 
+    def _close_serial(self):
+        """
+        Fecha a porta serial e aguarda o término da thread leitora.
+        """
+        self.connected = False
+        if self.serial and self.serial.is_open:
+            try:
+                self.serial.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Erro ao fechar a porta serial: {e}")
+        if self._rx_thread:
+            self._rx_thread.join(timeout=self.timeout)
+            self._rx_thread = None
+
+    def _reconnect_serial(self):
+        """
+        Reabre a porta serial após uma falha, com espera exponencial e jitter
+        entre as tentativas, até conseguir.
+        """
+        self._close_serial()
+        # Comandos pendentes não devem ser reenviados quando a porta voltar
+        self._discard_queued_commands()
+        backoff = _Backoff()
+        while not self.connected:
+            delay = backoff.next()
+            logger.warning(f"🔄 Tentando reconectar à porta serial em {delay:.1f}s...")
+            time.sleep(delay)
+            self.connect()
+
     def disconnect(self):
         """
         Desconecta da porta serial e do broker MQTT de forma limpa.
         """
         if self.serial and self.serial.is_open:
-            self.serial.close()
-            self.connected = False
+            self._close_serial()
             logger.info("🔌 Desconectado do SMS Gamer")
         if self.mqtt_client:
             self.mqtt_client.disconnect()
@@ -180,7 +446,7 @@ class SMSGamerProtocol:
         Returns:
             int: Checksum calculado.
         """
-        return (-1 * (cmd_byte + p1 + p2 + p3 + p4)) & 0xFF
+        return -(cmd_byte + p1 + p2 + p3 + p4) & 0xFF
 
     def build_full_command(self, cmd_byte: int, p1: int, p2: int, p3: int, p4: int) -> bytes:
         """
@@ -194,7 +460,135 @@ class SMSGamerProtocol:
             bytes: Comando completo pronto para envio.
         """
         checksum = self.calculate_checksum(cmd_byte, p1, p2, p3, p4)
-        return struct.pack('BBBBBB', cmd_byte, p1, p2, p3, p4, checksum) + b'\r'
+        _PKT_STRUCT.pack_into(self._cmd_buf, 0, cmd_byte, p1, p2, p3, p4, checksum)
+        return bytes(self._cmd_buf)
+
+    def _rx_loop(self, port: serial.Serial):
+        """
+        Thread leitora: lê continuamente a porta serial e coloca na fila cada
+        trecho terminado em 0x0D, liberando a thread principal do I/O bloqueante.
+
+        Args:
+            port (serial.Serial): Porta aberta por connect(); a thread termina
+                quando ela é fechada.
+        """
+        buf = bytearray()
+        while port.is_open:
+            try:
+                chunk = self._read_frame(port, buf, self._rx_flush)
+            except Exception as e:
+                if port.is_open:
+                    logger.error(f"❌ Erro na leitura da porta serial: {e}")
+                    # Sinaliza ao loop de monitoramento que a porta precisa ser reaberta
+                    self.connected = False
+                break
+            if chunk:
+                with self._rx_lock:
+                    if self._rx_flush.is_set():
+                        # Descarte pedido depois que o trecho foi lido: ele (e o
+                        # que sobrou em `buf`) é anterior ao comando novo
+                        self._rx_flush.clear()
+                        buf.clear()
+                        continue
+                    self._rx_q.put(chunk)
+
+    @staticmethod
+    def _read_frame(port: serial.Serial, buf: bytearray, flush: threading.Event) -> bytes:
+        """
+        Extrai o próximo trecho terminado em 0x0D, lendo a porta em blocos.
+
+        Em vez de uma chamada de leitura por byte (read_until), bloqueia no
+        kernel até chegar o primeiro byte (respeitando o timeout da porta) e
+        então consome de uma vez tudo o que já estiver em `in_waiting`. Bytes
+        recebidos além do terminador ficam em `buf` para o próximo trecho.
+
+        Quando `flush` é sinalizado (antes de cada escrita de comando), o que
+        ainda estiver em `buf` é descartado: um quadro parcial antigo não é
+        concatenado à próxima resposta.
+
+        Args:
+            port (serial.Serial): Porta serial aberta.
+            buf (bytearray): Buffer de recepção persistente da thread leitora.
+            flush (threading.Event): Pedido para descartar o conteúdo de `buf`.
+
+        Returns:
+            bytes: Trecho terminado em 0x0D; trecho parcial se o timeout expirar
+            no meio de um quadro ou se RESPONSE_MAX_SIZE for atingido; vazio se
+            nada chegar.
+        """
+        while True:
+            if flush.is_set():
+                flush.clear()
+                buf.clear()
+            end = buf.find(b'\r')
+            if end >= 0:
+                chunk = bytes(buf[:end + 1])
+                del buf[:end + 1]
+                return chunk
+            if len(buf) >= RESPONSE_MAX_SIZE:
+                break
+            data = port.read(1)
+            if flush.is_set():
+                # Comando escrito durante a espera: `data` já pertence à nova resposta
+                flush.clear()
+                buf.clear()
+            if not data:
+                break
+            buf += data
+            waiting = port.in_waiting
+            if waiting:
+                buf += port.read(waiting)
+        chunk = bytes(buf)
+        buf.clear()
+        return chunk
+
+    def _read_response(self, min_size: Optional[int] = None) -> bytes:
+        """
+        Aguarda a resposta do UPS entregue pela thread leitora (_rx_loop).
+
+        As respostas são binárias e podem conter 0x0D entre os dados, por isso
+        os trechos recebidos são concatenados: até `min_size` bytes quando o
+        tamanho é conhecido ('Q'), ou até uma pausa de RESPONSE_QUIET_GAP sem
+        novos trechos ('I', 'F' e comandos sem tamanho mapeado), limitado a
+        RESPONSE_MAX_SIZE.
+
+        Args:
+            min_size (Optional[int]): Tamanho esperado da resposta, ou None se
+                for desconhecido.
+
+        Returns:
+            bytes: Bytes recebidos (vazio se o UPS não responder dentro do timeout).
+        """
+        response = b''
+        wait = self.timeout
+        while len(response) < (min_size or RESPONSE_MAX_SIZE):
+            try:
+                chunk = self._rx_q.get(timeout=wait)
+            except queue.Empty:
+                break
+            response += chunk
+            if not chunk.endswith(b'\r'):
+                # Trecho parcial: a thread leitora já esperou o timeout da porta
+                break
+            if min_size is None:
+                wait = RESPONSE_QUIET_GAP
+        return response
+
+    def _drain_rx_queue(self):
+        """
+        Descarta respostas atrasadas ainda na fila, para que o próximo comando
+        não receba a resposta de um comando anterior, e pede à thread leitora
+        que descarte bytes de um quadro parcial ainda não entregue à fila.
+        """
+        with self._rx_lock:
+            self._rx_flush.set()
+            while True:
+                try:
+                    stale = self._rx_q.get_nowait()
+                except queue.Empty:
+                    return
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("🗑️ Descartando resposta atrasada: %s", stale.hex())
 
     def send_simple_command(self, command_char: str) -> Optional[bytes]:
         """
@@ -208,18 +602,19 @@ class SMSGamerProtocol:
         """
         if command_char not in self.simple_commands_map:
             raise ValueError(f"Comando simples '{command_char}' não suportado")
-        cmd_byte = self.simple_commands_map[command_char]
-        cmd_packet = self.build_full_command(cmd_byte, 0xFF, 0xFF, 0xFF, 0xFF)
+        cmd_packet = SMS_GAMER_COMMAND_PACKETS[command_char]
 
         if not self.connected or not self.serial:
             return None
         try:
-            logger.debug(f"📤 Enviando comando '{command_char}': {cmd_packet.hex()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📤 Enviando comando '%s': %s", command_char, cmd_packet.hex())
+            self._drain_rx_queue()
             self.serial.write(cmd_packet)
-            time.sleep(0.2)
-            response = self.serial.read(64)
+            response = self._read_response(RESPONSE_MIN_SIZES.get(command_char))
             if response:
-                logger.debug(f"📥 Resposta ({len(response)} bytes): {response.hex()}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("📥 Resposta (%d bytes): %s", len(response), response.hex())
                 return response
             else:
                 logger.warning("❌ Sem resposta do SMS Gamer")
@@ -228,6 +623,51 @@ class SMSGamerProtocol:
             logger.error(f"❌ Erro ao enviar comando '{command_char}': {e}")
             return None
 
+    def send_many(self, command_keys: List[str]) -> List[Optional[bytes]]:
+        """
+        Envia vários comandos em uma única escrita e coleta as respostas em ordem,
+        pagando a latência fixa de ida e volta uma vez só.
+
+        Destinado a comandos de consulta que sempre respondem (Q, I, F): um comando
+        sem resposta desalinharia as respostas seguintes. Uma resposta de tamanho
+        desconhecido só termina numa pausa da linha, então cada comando desses
+        encerra um lote e os seguintes vão em uma nova escrita.
+
+        Args:
+            command_keys (List[str]): Chaves no dicionário SMS_GAMER_COMMANDS_PARAMS.
+
+        Returns:
+            List[Optional[bytes]]: Resposta de cada comando (None quando não houve),
+            ou lista vazia se houver erro.
+        """
+        unknown = [key for key in command_keys if key not in SMS_GAMER_COMMAND_PACKETS]
+        if unknown:
+            logger.error(f"❌ Comandos predefinidos não encontrados: {', '.join(unknown)}")
+            return []
+        if not self.connected or not self.serial:
+            logger.error("❌ Porta serial não conectada para enviar comandos.")
+            return []
+
+        # Lotes terminados em um comando de tamanho de resposta desconhecido
+        batches: List[List[str]] = [[]]
+        for key in command_keys:
+            batches[-1].append(key)
+            if key not in RESPONSE_MIN_SIZES:
+                batches.append([])
+
+        try:
+            responses: List[Optional[bytes]] = []
+            for batch in batches:
+                if not batch:
+                    continue
+                self._drain_rx_queue()
+                self.serial.write(b''.join(SMS_GAMER_COMMAND_PACKETS[key] for key in batch))
+                responses.extend(self._read_response(RESPONSE_MIN_SIZES.get(key)) or None for key in batch)
+            return responses
+        except Exception as e:
+            logger.error(f"❌ Erro ao enviar comandos {command_keys}: {e}")
+            return []
+
     def _interpret_q_response(self, response: bytes) -> Optional[Dict[str, Any]]:
         """
         Interpreta a resposta do comando 'Q' (status do UPS).
@@ -238,81 +678,71 @@ class SMSGamerProtocol:
         Returns:
             Optional[Dict[str, Any]]: Dados interpretados ou None se houver erro.
         """
-        if not response or len(response) < 17:
-            logger.warning(f"⚠️ Resposta muito curta ou vazia para interpretação: {len(response) if response else 0} bytes")
+        if not response or len(response) != Q_RESPONSE_SIZE:
+            logger.warning(f"⚠️ Resposta com tamanho inválido para interpretação: {len(response) if response else 0} bytes")
+            return None
+        if response[0] != Q_RESPONSE_HEADER:
+            # Quadro desalinhado (ex.: bytes atrasados de outra resposta): não decodifica
+            logger.warning(f"⚠️ Cabeçalho inválido na resposta 'Q': 0x{response[0]:02X}")
             return None
 
         try:
-            if response[-1] == 0x0D:
-                response = response[:-1]
-
-            vin = struct.unpack(">I", response[1:5])[0] / 10.0
-            vout = struct.unpack(">H", response[5:7])[0] / 10.0
-            power = struct.unpack(">H", response[7:9])[0] / 10.0
-            freq = struct.unpack(">H", response[9:11])[0] / 10.0
-            batt = struct.unpack(">H", response[11:13])[0] / 10.0
-            temp = struct.unpack(">H", response[13:15])[0] / 10.0
-            extra = response[15]
-
-            extra_flags_bin = f"{extra:08b}"
-
-            flags_bits = {
-                7: "BateriaEmUso",
-                6: "BateriaBaixa",
-                5: "ByPass",
-                4: "Boost",
-                3: "UpsOk",
-                2: "TesteAtivo",
-                1: "ShutdownAtivo",
-                0: "BeepLigado",
-            }
+            # memoryview: remover o terminador não copia o quadro
+            frame = memoryview(response)
+            if frame[-1] == 0x0D:
+                frame = frame[:-1]
 
-            flags_on = [name for bit, name in flags_bits.items() if extra & (1 << bit)]
-            flags_str = ', '.join(flags_on) if flags_on else 'nenhuma flag ativa'
-
-            data = {
-                'vin': round(vin, 1),
-                'vout': round(vout, 1),
-                'load_percent': round(power, 1),
-                'frequency': round(freq, 1),
-                'battery_percent': round(batt, 1),
-                'temperature': round(temp, 1),
-                'extra_flags_raw': extra,
-                'extra_flags_binary': extra_flags_bin,
-                'active_flags': flags_on,
-                'active_flags_str': flags_str,
-                'raw_response_hex': response.hex(),
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-            }
-            return data
+            return parse_q_frame(frame)
 
         except Exception as e:
             logger.error(f"❌ Erro ao interpretar pacote 'Q': {e}")
             return None
 
-    def _on_mqtt_connect(self, client, userdata, flags, rc):
+    def _on_mqtt_connect(self, client, userdata, flags, rc, properties=None):
         """
         Callback executado quando o cliente MQTT se conecta ou reconecta ao broker.
         Assina tópicos, limpa mensagens retidas e publica discovery.
         """
         if rc == 0:
             logger.info("✅ Conectado ao broker MQTT com sucesso.")
+            # Aliases valem só para a conexão atual; o broker informa o limite no CONNACK
+            alias_max = getattr(properties, "TopicAliasMaximum", 0)
+            with self._status_alias_lock:
+                self._status_alias_enabled = alias_max >= STATUS_TOPIC_ALIAS
+                self._status_alias_sent = False
+            # Desativa o algoritmo de Nagle: os PUBLISH são pequenos e não devem
+            # esperar o acúmulo de dados no socket (refeito a cada reconexão)
+            try:
+                client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (AttributeError, OSError) as e:
+                logger.debug(f"Não foi possível ativar TCP_NODELAY: {e}")
             # Assina o tópico de comando novamente em caso de reconexão
-            client.subscribe(f"{self.MQTT_TOPIC_BASE}/command")
-            logger.info(f"✅ Assinado '{self.MQTT_TOPIC_BASE}/command' após reconexão.")
+            client.subscribe(self._command_topic)
+            logger.info(f"✅ Assinado '{self._command_topic}' após reconexão.")
             # Limpa mensagens retidas após reconexão
-            command_topic = f"{self.MQTT_TOPIC_BASE}/command"
-            client.publish(command_topic, payload=None, qos=1, retain=True)
-            logger.info(f"✅ Limpando mensagens retidas no tópico de comando: '{command_topic}' após reconexão.")
-            # Publica mensagens de discovery novamente em caso de reconexão
-            self.publish_discovery_messages()
+            client.publish(self._command_topic, payload=None, qos=1, retain=True)
+            logger.info(f"✅ Limpando mensagens retidas no tópico de comando: '{self._command_topic}' após reconexão.")
+            # Birth message do HA: republica o discovery quando o HA reinicia
+            client.subscribe(self._ha_status_topic)
+            # Os configs são retidos no broker; uma reconexão só os reenvia se
+            # algum não chegou a ser confirmado antes da queda
+            if not self._discovery_delivered():
+                self.publish_discovery_messages()
+            # Força a republicação do status na próxima leitura
+            self._last_status = {}
+            self._mqtt_ready.set()
         else:
             logger.error(f"❌ Falha na conexão MQTT, código de retorno: {rc}")
 
-    def _on_mqtt_disconnect(self, client, userdata, rc):
+    def _on_mqtt_disconnect(self, client, userdata, rc, properties=None):
         """
         Callback executado quando o cliente MQTT se desconecta do broker.
         """
+        # O mapeamento do alias morre com a conexão: até o próximo CONNACK o
+        # status vai com o tópico completo
+        with self._status_alias_lock:
+            self._status_alias_enabled = False
+            self._status_alias_sent = False
         if rc != 0:
             logger.warning(f"⚠️ Desconexão inesperada do broker MQTT. Tentando reconectar... (código: {rc})")
         else:
@@ -327,22 +757,37 @@ class SMSGamerProtocol:
             userdata: Dados do usuário.
             msg: Mensagem MQTT recebida.
         """
-        logger.info(f"📥 Mensagem MQTT recebida no tópico '{msg.topic}': {msg.payload.decode()}")
+        raw = msg.payload
+        if not raw:
+            # Mensagem vazia: limpeza do comando retido feita em _on_mqtt_connect
+            return
+        text = raw.decode('utf-8', 'replace')
+        if msg.topic == self._ha_status_topic:
+            if text == "online":
+                logger.info("🏠 Home Assistant online, republicando mensagens de discovery.")
+                self.publish_discovery_messages()
+            return
+        logger.info("📥 Mensagem MQTT recebida no tópico '%s': %s", msg.topic, text)
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = _json_loads(raw)
             command_key = payload.get("command")
 
             if command_key:
                 if command_key in SMS_GAMER_COMMANDS_PARAMS:
-                    self.send_predefined_command(command_key)
-                    logger.info(f"Comando '{command_key}' enviado via MQTT.")
+                    if not self.connected:
+                        logger.error(f"❌ Porta serial não conectada, comando '{command_key}' descartado.")
+                        return
+                    self._cmd_queue.put_nowait((command_key, time.monotonic()))
+                    logger.info(f"Comando '{command_key}' recebido via MQTT e enfileirado.")
+                    # Acorda o loop de monitoramento para enviar o comando e publicar o efeito
+                    self._wakeup.set()
                 else:
                     logger.warning(f"Comando MQTT '{command_key}' não reconhecido ou não implementado para controle.")
             else:
                 logger.warning("Payload MQTT de comando não contém 'command' key.")
 
         except json.JSONDecodeError:
-            logger.error(f"❌ Erro ao decodificar payload JSON: {msg.payload.decode()}")
+            logger.error(f"❌ Erro ao decodificar payload JSON: {text}")
         except Exception as e:
             logger.error(f"❌ Erro ao processar comando MQTT: {e}")
 
@@ -354,7 +799,7 @@ class SMSGamerProtocol:
             bool: True se a conexão for bem-sucedida, False caso contrário.
         """
         try:
-            self.mqtt_client = mqtt.Client(client_id=self.MQTT_CLIENT_ID, protocol=mqtt.MQTTv311)
+            self.mqtt_client = mqtt.Client(client_id=self.MQTT_CLIENT_ID, protocol=mqtt.MQTTv5)
             self.mqtt_client.username_pw_set(self.MQTT_USERNAME, self.MQTT_PASSWORD)
             self.mqtt_client.on_connect = self._on_mqtt_connect
             self.mqtt_client.on_disconnect = self._on_mqtt_disconnect
@@ -372,15 +817,17 @@ class SMSGamerProtocol:
             logger.error(f"❌ Erro ao conectar ao broker MQTT: {e}")
             return False
 
-    def publish_discovery_messages(self):
+    def _prepare_discovery(self) -> List[Tuple[str, bytes]]:
         """
-        Publica mensagens de descoberta MQTT para o Home Assistant.
+        Monta uma única vez as mensagens de descoberta MQTT para o Home Assistant.
         Cria sensores, binary sensors, switches e buttons automaticamente.
-        """
-        if not self.mqtt_client:
-            logger.error("❌ Cliente MQTT não conectado para publicar mensagens de descoberta.")
-            return
 
+        Todos os campos dependem apenas da configuração conhecida no __init__,
+        então os payloads já são serializados em bytes para reuso a cada (re)conexão.
+
+        Returns:
+            List[Tuple[str, bytes]]: Pares (tópico de config, payload JSON).
+        """
         device_info = {
             "identifiers": [self.MQTT_CLIENT_ID],
             "name": self.DEVICE_NAME,
@@ -388,6 +835,7 @@ class SMSGamerProtocol:
             "model": self.DEVICE_MODEL,
             "sw_version": self.DEVICE_SW_VERSION,
         }
+        to_publish = []
 
         # Sensores numéricos
         sensors_to_discover = {
@@ -406,15 +854,14 @@ class SMSGamerProtocol:
             payload = {
                 "name": f"{self.DEVICE_NAME} {config['name']}",
                 "unique_id": unique_id,
-                "state_topic": f"{self.MQTT_TOPIC_BASE}/status",
+                "state_topic": self._status_topic,
                 "value_template": f"{{{{ value_json.{key} }}}}",
                 "device": device_info,
                 "qos": 1,
-                "force_update": True
+                "force_update": True,
+                **{k: v for k, v in config.items() if k != "name"},
             }
-            payload.update({k: v for k, v in config.items() if k != "name"})
-            self.mqtt_client.publish(config_topic, json.dumps(payload), qos=1, retain=True)
-            logger.info(f"✅ Publicado discovery para {config['name']} em {config_topic}")
+            to_publish.append((config_topic, _json_dumps(payload)))
 
         # Binary sensors (flags de status)
         binary_flags = {
@@ -432,18 +879,21 @@ class SMSGamerProtocol:
         for flag_key, config in binary_flags.items():
             unique_id = f"{self.MQTT_CLIENT_ID}_{flag_key.lower()}"
             config_topic = f"{self.HA_DISCOVERY_PREFIX}/binary_sensor/{unique_id}/config"
+            # Template Jinja montado por concatenação (sem escapar chaves em f-string)
+            value_template = config.get("value_template") or (
+                "{% if '" + flag_key + "' in value_json.active_flags %}ON{% else %}OFF{% endif %}"
+            )
             payload = {
                 "name": f"{self.DEVICE_NAME} {config['name']}",
                 "unique_id": unique_id,
-                "state_topic": f"{self.MQTT_TOPIC_BASE}/status",
+                "state_topic": self._status_topic,
                 "device": device_info,
                 "qos": 1,
-                "retain": True
+                "retain": True,
+                "value_template": value_template,
+                **{k: v for k, v in config.items() if k not in ("name", "value_template")},
             }
-            payload["value_template"] = config.get("value_template", f"{{% if '{flag_key}' in value_json.active_flags %}}ON{{% else %}}OFF{{% endif %}}")
-            payload.update({k: v for k, v in config.items() if k not in ["name", "value_template"]})
-            self.mqtt_client.publish(config_topic, json.dumps(payload), qos=1, retain=True)
-            logger.info(f"✅ Publicado discovery para {config['name']} (Binary) em {config_topic}")
+            to_publish.append((config_topic, _json_dumps(payload)))
 
         # Controles (Switch para beep)
         beep_unique_id = f"{self.MQTT_CLIENT_ID}_beep_control"
@@ -451,9 +901,9 @@ class SMSGamerProtocol:
         beep_payload = {
             "name": f"{self.DEVICE_NAME} Beep Control",
             "unique_id": beep_unique_id,
-            "state_topic": f"{self.MQTT_TOPIC_BASE}/status",
+            "state_topic": self._status_topic,
             "value_template": "{% if 'BeepLigado' in value_json.active_flags %}ON{% else %}OFF{% endif %}",
-            "command_topic": f"{self.MQTT_TOPIC_BASE}/command",
+            "command_topic": self._command_topic,
             "payload_on": '{"command": "M"}',
             "payload_off": '{"command": "M"}',
             "device": device_info,
@@ -461,8 +911,7 @@ class SMSGamerProtocol:
             "retain": True,
             "icon": "mdi:volume-high"
         }
-        self.mqtt_client.publish(beep_config_topic, json.dumps(beep_payload), qos=1, retain=True)
-        logger.info(f"✅ Publicado discovery para Beep Control em {beep_config_topic}")
+        to_publish.append((beep_config_topic, _json_dumps(beep_payload)))
 
         # Buttons para ações
         buttons_config = {
@@ -478,15 +927,120 @@ class SMSGamerProtocol:
             payload = {
                 "name": f"{self.DEVICE_NAME} {config['name']}",
                 "unique_id": unique_id,
-                "command_topic": f"{self.MQTT_TOPIC_BASE}/command",
+                "command_topic": self._command_topic,
                 "payload_press": f'{{"command": "{config["command"]}"}}',
                 "device": device_info,
                 "qos": 1,
                 "retain": True,
                 "icon": config["icon"]
             }
-            self.mqtt_client.publish(config_topic, json.dumps(payload), qos=1, retain=True)
-            logger.info(f"✅ Publicado discovery para {config['name']} em {config_topic}")
+            to_publish.append((config_topic, _json_dumps(payload)))
+
+        return to_publish
+
+    def publish_discovery_messages(self):
+        """
+        Publica as mensagens de descoberta MQTT pré-montadas para o Home Assistant.
+        """
+        if not self.mqtt_client:
+            logger.error("❌ Cliente MQTT não conectado para publicar mensagens de descoberta.")
+            return
+
+        # Envia tudo de uma vez; o loop do paho (loop_start) drena a fila de saída.
+        # QoS 1: is_published() só fica True com o PUBACK do broker, e o paho
+        # reenvia o que ficou sem confirmação ao reconectar
+        self._discovery_infos = [
+            self.mqtt_client.publish(topic, payload, qos=1, retain=True)
+            for topic, payload in self._discovery_frames
+        ]
+        logger.info(f"✅ Publicadas {len(self._discovery_frames)} mensagens de discovery em '{self.HA_DISCOVERY_PREFIX}'")
+
+    def _discovery_delivered(self) -> bool:
+        """
+        Verifica se todas as mensagens do último envio de discovery foram publicadas.
+
+        Returns:
+            bool: False se o discovery nunca foi enviado ou se alguma mensagem
+            ficou pendente (ex.: conexão caiu no meio do envio).
+        """
+        return bool(self._discovery_infos) and all(info.is_published() for info in self._discovery_infos)
+
+    def _status_changed(self, data: Dict[str, Any]) -> bool:
+        """
+        Verifica se o status difere do último publicado (ignorando o timestamp).
+
+        O payload é sempre publicado completo: cada entidade do Home Assistant
+        extrai o seu campo via value_template e um payload parcial a deixaria
+        sem valor.
+
+        Args:
+            data (Dict[str, Any]): Status recém-interpretado.
+
+        Returns:
+            bool: True se algum campo mudou desde a última publicação.
+        """
+        last = self._last_status
+        return any(last.get(key) != value for key, value in data.items() if key != 'timestamp')
+
+    def _publish_status(self, data: Dict[str, Any]):
+        """
+        Publica no MQTT os campos de status usados pelo Home Assistant,
+        apenas quando algo mudou desde a última publicação ou, como heartbeat,
+        após STATUS_HEARTBEAT_POLLS leituras inalteradas.
+
+        Args:
+            data (Dict[str, Any]): Status completo retornado por _interpret_q_response.
+        """
+        status = {key: data[key] for key in _MQTT_STATUS_FIELDS}
+        if not self._status_changed(status):
+            self._unchanged_polls += 1
+            if self._unchanged_polls < STATUS_HEARTBEAT_POLLS:
+                logger.debug("Status do UPS inalterado, publicação ignorada.")
+                return
+
+        payload = _json_dumps(status)
+        with self._status_alias_lock:
+            if self._status_alias_enabled:
+                topic = "" if self._status_alias_sent else self._status_topic
+                info = self.mqtt_client.publish(topic, payload, qos=0, retain=True,
+                                                properties=self._status_props)
+                # Só conta como mapeado se o PUBLISH com o tópico completo saiu
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self._status_alias_sent = True
+            else:
+                self.mqtt_client.publish(self._status_topic, payload, qos=0, retain=True)
+        self._last_status = status
+        self._unchanged_polls = 0
+        logger.debug("✅ Dados publicados no MQTT em '%s'", self._status_topic)
+
+    def _run_queued_commands(self):
+        """
+        Envia ao UPS os comandos recebidos via MQTT, na ordem de chegada.
+
+        Executado na thread do loop de monitoramento, entre as leituras 'Q',
+        para que os comandos nunca disputem a porta serial com a consulta de status.
+        """
+        while True:
+            try:
+                command_key, received_at = self._cmd_queue.get_nowait()
+            except queue.Empty:
+                return
+            if time.monotonic() - received_at > COMMAND_MAX_AGE:
+                logger.warning(f"⚠️ Comando '{command_key}' expirado na fila, descartado.")
+                continue
+            self.send_predefined_command(command_key)
+
+    def _discard_queued_commands(self):
+        """
+        Descarta os comandos MQTT ainda na fila (ex.: porta serial caiu antes
+        de serem enviados).
+        """
+        while True:
+            try:
+                command_key, _ = self._cmd_queue.get_nowait()
+            except queue.Empty:
+                return
+            logger.warning(f"⚠️ Comando '{command_key}' descartado: porta serial desconectada.")
 
     def mqtt_monitor_loop(self, interval: float = 10):
         """
@@ -502,26 +1056,38 @@ class SMSGamerProtocol:
             logger.error("❌ Não foi possível conectar ao broker MQTT. Verifique as configurações.")
             return
 
-        # Aguarda um pouco para garantir que a conexão MQTT esteja estabelecida
-        time.sleep(2)
+        # Aguarda o CONNACK em vez de uma espera fixa; segue mesmo sem ele,
+        # pois o paho continua tentando reconectar em segundo plano
+        if not self._mqtt_ready.wait(timeout=MQTT_READY_TIMEOUT):
+            logger.warning("⚠️ Conexão MQTT ainda não confirmada, iniciando o monitoramento assim mesmo.")
 
         logger.info(f"📡 Monitorando e publicando dados no MQTT a cada {interval:.1f}s...")
         try:
+            # Prazo monotônico: o período não acumula o tempo gasto em I/O a cada ciclo
+            next_tick = time.monotonic()
             while True:
+                if not self.connected:
+                    self._reconnect_serial()
+                self._run_queued_commands()
                 response = self.send_simple_command('Q')
                 if response:
                     interpreted_data = self._interpret_q_response(response)
                     if interpreted_data:
-                        full_topic = f"{self.MQTT_TOPIC_BASE}/status"
-                        payload = json.dumps(interpreted_data, ensure_ascii=False)
-                        self.mqtt_client.publish(full_topic, payload, qos=1, retain=False)
-                        logger.info(f"✅ Dados publicados no MQTT em '{full_topic}'")
+                        self._publish_status(interpreted_data)
                     else:
                         logger.warning("⚠️ Não foi possível interpretar a resposta do UPS.")
                 else:
                     logger.warning("⚠️ Sem resposta do UPS para o comando 'Q'.")
 
-                time.sleep(interval)
+                next_tick += interval
+                now = time.monotonic()
+                if next_tick < now:
+                    # Ciclo atrasou mais que um intervalo: não tenta recuperar em rajada
+                    next_tick = now + interval
+                if self._wakeup.wait(next_tick - now):
+                    # Comando recebido via MQTT: lê o status já, sem esperar o intervalo
+                    self._wakeup.clear()
+                    next_tick = time.monotonic()
         except KeyboardInterrupt:
             logger.info("🛑 Interrompido pelo usuário.")
         except Exception as e:
@@ -537,25 +1103,24 @@ class SMSGamerProtocol:
         Returns:
             Optional[bytes]: Resposta do UPS ou None se houver erro.
         """
-        params = SMS_GAMER_COMMANDS_PARAMS.get(command_key)
-        if not params:
+        cmd_packet = SMS_GAMER_COMMAND_PACKETS.get(command_key)
+        if not cmd_packet:
             logger.error(f"❌ Comando predefinido '{command_key}' não encontrado.")
             return None
 
-        cmd_byte, p1, p2, p3, p4 = params
-        cmd_packet = self.build_full_command(cmd_byte, p1, p2, p3, p4)
-
         if not self.connected or not self.serial:
             logger.error("❌ Porta serial não conectada para enviar comando predefinido.")
             return None
 
         try:
-            logger.info(f"📤 Enviando comando predefinido '{command_key}': {cmd_packet.hex()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📤 Enviando comando predefinido '%s': %s", command_key, cmd_packet.hex())
+            self._drain_rx_queue()
             self.serial.write(cmd_packet)
-            time.sleep(1)
-            response = self.serial.read(64)
+            response = self._read_response(RESPONSE_MIN_SIZES.get(command_key))
             if response:
-                logger.info(f"📥 Resposta ({len(response)} bytes): {response.hex()}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("📥 Resposta (%d bytes): %s", len(response), response.hex())
                 return response
             else:
                 logger.warning(f"⚠️ Sem resposta para o comando predefinido '{command_key}'.")